@@ -1,7 +1,7 @@
 import os
-import time
-import pickle
-from typing import Dict, Any
+import orjson
+import threading
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -17,17 +17,163 @@ from ast import literal_eval
 
 SUBMIT = literal_eval(os.getenv("SUBMIT_FORM", "False"))
 
+# Set every named field's value and fire the events the page listens for;
+# returns the names that were not found
+FILL_FIELDS_JS = """
+const missing = [];
+for (const [name, value] of Object.entries(arguments[0])) {
+    const elem = document.getElementsByName(name)[0];
+    if (!elem) { missing.push(name); continue; }
+    elem.value = value;
+    elem.dispatchEvent(new Event('input', {bubbles: true}));
+    elem.dispatchEvent(new Event('change', {bubbles: true}));
+}
+return missing;
+"""
+
+# Select each named dropdown's option by visible text; returns the names
+# whose option could not be found so they can fall back to select_dropdown
+SELECT_OPTIONS_JS = """
+const unmatched = [];
+for (const [name, text] of Object.entries(arguments[0])) {
+    const select = document.getElementsByName(name)[0];
+    const index = select ? Array.from(select.options).findIndex(o => o.text === text) : -1;
+    if (index < 0) { unmatched.push(name); continue; }
+    select.selectedIndex = index;
+    select.dispatchEvent(new Event('change', {bubbles: true}));
+}
+return unmatched;
+"""
+
+# Page selectors, resolved by chromedriver through document.querySelector
+SUBMIT_BUTTON = (By.CSS_SELECTOR, "button[type='submit']")
+FORM_TAB = (
+    By.CSS_SELECTOR,
+    "body > div:nth-of-type(2) > div:nth-of-type(2) > div > div:nth-of-type(2) > div > div"
+    " > div:nth-of-type(1) > ul > li:nth-of-type(2) > a"
+)
+SELECT2_OPTION = (By.CSS_SELECTOR, "li.select2-results__option")
+SELECT2_CONTAINER_CSS = "select[name='{}'] ~ span.select2-container"
+SELECT2_OPTION_XPATH = "//li[contains(@class, 'select2-results__option') and text()={}]"
+LOADING_SPINNER = (By.CSS_SELECTOR, ".loading")
+
+# URL patterns the browser never fetches
+BLOCKED_URLS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*fonts.googleapis.com*",
+    "*fonts.gstatic.com*",
+    "*.woff2",
+    "*.woff",
+    "*.ttf",
+    "*/ads/*",
+]
+
+# Keys every cached cookie must carry before it is handed to add_cookie
+REQUIRED_COOKIE_KEYS = {"name", "value"}
+
+# urllib3 pool size for the HTTP connection between Selenium and chromedriver
+DRIVER_HTTP_POOL_SIZE = int(os.getenv("DRIVER_HTTP_POOL_SIZE", 20))
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def create_driver(driver_path: str) -> webdriver.Chrome:
+    """Create a headless Chrome driver using an already resolved chromedriver path."""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+
+    # Only the DOM is needed to fill the form, so skip images and background work
+    chrome_options.page_load_strategy = "eager"
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-background-networking")
+    chrome_options.add_argument("--disable-features=Translate")
+    chrome_options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+    })
+
+    driver = webdriver.Chrome(
+        service=Service(driver_path),
+        options=chrome_options,
+        keep_alive=True
+    )
+    _enlarge_command_pool(driver)
+
+    # Block third-party analytics, ads and web fonts the form does not need
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+def _enlarge_command_pool(driver: webdriver.Chrome):
+    """Rebuild the driver's urllib3 pool so command bursts reuse kept-alive sockets."""
+    executor = driver.command_executor
+    # Relies on Selenium >= 4.26 internals; keep the default pool if they are missing
+    if not all(hasattr(executor, attr) for attr in ("_client_config", "_conn", "_get_connection_manager")):
+        logger.warning("Selenium connection internals not found, keeping the default chromedriver pool size")
+        return
+    executor._client_config.init_args_for_pool_manager = {
+        "init_args_for_pool_manager": {"maxsize": DRIVER_HTTP_POOL_SIZE}
+    }
+    executor._conn.clear()
+    executor._conn = executor._get_connection_manager()
+
+
+def resolve_driver_path() -> str:
+    """Resolve the chromedriver binary once so drivers can be spawned without network I/O."""
+    # Preinstalled at image build time; only download when running outside Docker
+    driver_path = os.getenv("CHROMEDRIVER_PATH")
+    if driver_path and os.path.exists(driver_path):
+        return driver_path
+    return ChromeDriverManager().install()
+
+
+def reset_driver(driver: webdriver.Chrome):
+    """Clear session state so a pooled driver can be handed to the next task."""
+    driver.delete_all_cookies()
+    driver.get("about:blank")
+
+
+def to_cdp_cookie(cookie: Dict[str, Any], url: str) -> Dict[str, Any]:
+    """Convert a Selenium cookie dict into a CDP Network.CookieParam."""
+    params = {"name": cookie["name"], "value": cookie["value"]}
+    if cookie.get("domain"):
+        params["domain"] = cookie["domain"]
+    else:
+        params["url"] = url
+    for key in ("path", "secure", "httpOnly", "sameSite"):
+        if key in cookie:
+            params[key] = cookie[key]
+    if "expiry" in cookie:
+        params["expires"] = cookie["expiry"]
+    return params
+
+
+def xpath_literal(value: str) -> str:
+    """Quote a value as an XPath string literal, even when it contains both quote types."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    parts = value.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in parts) + ")"
+
+
 class FormAutofiller:
     """Enhanced class to autofill the travel form using Selenium with async support."""
 
-    def __init__(self, form_url: str, login_url: str, cookie_path: str = "cookies.pkl"):
+    def __init__(self, driver: webdriver.Chrome, form_url: str, login_url: str, cookie_path: str = "cookies.json"):
+        self.driver = driver
         self.form_url = form_url
         self.login_url = login_url
         self.cookie_path = cookie_path
-        self.driver = None
 
         # Load environment variables
         load_dotenv()
@@ -37,31 +183,16 @@ class FormAutofiller:
         if not self.username or not self.password:
             raise Exception("LOGIN_USERNAME or LOGIN_PASSWORD not set in .env")
 
-    def _setup_driver(self):
-        """Setup Chrome driver with options."""
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        
-        self.driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()), 
-            options=chrome_options
-        )
-
     def login(self) -> bool:
         """Perform login or load cookies if available."""
         try:
-            if os.path.exists(self.cookie_path):
+            cookies = self.load_cookies()
+            if cookies:
                 logger.info("Loading cookies...")
-                self.driver.get("https://adventurescare.com")
-                with open(self.cookie_path, "rb") as f:
-                    cookies = pickle.load(f)
-                for cookie in cookies:
-                    self.driver.add_cookie(cookie)
-                self.driver.refresh()
+                # CDP sets cookies without first navigating to the cookie domain
+                self.driver.execute_cdp_cmd("Network.setCookies", {
+                    "cookies": [to_cdp_cookie(cookie, self.form_url) for cookie in cookies]
+                })
                 self.driver.get(self.form_url)
                 if "login" not in self.driver.current_url.lower():
                     logger.info("Logged in using cookies")
@@ -74,16 +205,14 @@ class FormAutofiller:
             WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.NAME, "email")))
             self.driver.find_element(By.NAME, "email").send_keys(self.username)
             self.driver.find_element(By.NAME, "password").send_keys(self.password)
-            self.driver.find_element(By.XPATH, "//button[@type='submit']").click()
+            self.driver.find_element(*SUBMIT_BUTTON).click()
 
             # Wait until redirected to the form or dashboard
             WebDriverWait(self.driver, 10).until(lambda d: "login" not in d.current_url.lower())
             logger.info("Logged in successfully")
 
             # Save cookies
-            cookies = self.driver.get_cookies()
-            with open(self.cookie_path, "wb") as f:
-                pickle.dump(cookies, f)
+            self.save_cookies(self.driver.get_cookies())
             logger.info("Cookies saved")
             return True
 
@@ -91,10 +220,36 @@ class FormAutofiller:
             logger.error(f"Login failed: {e}")
             return False
 
+    def load_cookies(self) -> Optional[List[Dict[str, Any]]]:
+        """Load cached cookies, ignoring a missing, unreadable or malformed cache."""
+        if not os.path.exists(self.cookie_path):
+            return None
+        try:
+            with open(self.cookie_path, "rb") as f:
+                cookies = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable cookie cache: {e}")
+            return None
+
+        if not isinstance(cookies, list) or not all(
+            isinstance(cookie, dict) and REQUIRED_COOKIE_KEYS <= cookie.keys() for cookie in cookies
+        ):
+            logger.warning("Ignoring malformed cookie cache")
+            return None
+        return cookies
+
+    def save_cookies(self, cookies: List[Dict[str, Any]]):
+        """Write cookies to the cache atomically so concurrent readers never see a partial file."""
+        tmp_path = f"{self.cookie_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(cookies))
+        os.replace(tmp_path, self.cookie_path)
+
     def load_form(self) -> bool:
-        """Load the form page."""
+        """Load the form page, unless the cookie login already landed on it."""
         try:
-            self.driver.get(self.form_url)
+            if self.driver.current_url != self.form_url:
+                self.driver.get(self.form_url)
             logger.info("Form page loaded")
             return True
         except Exception as e:
@@ -105,38 +260,41 @@ class FormAutofiller:
         """Fill the form with the given data."""
         try:
             WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "/html/body/div[2]/div[2]/div/div[2]/div/div/div[1]/ul/li[2]/a"))
-            )
-            self.driver.find_element(By.XPATH, '/html/body/div[2]/div[2]/div/div[2]/div/div/div[1]/ul/li[2]/a').click()
+                EC.presence_of_element_located(FORM_TAB)
+            ).click()
             
             WebDriverWait(self.driver, 10).until(
                 EC.presence_of_element_located((By.NAME, "nationality"))
             )
             
-            # Fill dropdown fields
-            self.select_dropdown("nationality", data["nationality"])
-            self.select_dropdown("travel_from", data["travel_from"])
-            self.select_dropdown("travel_to", "Nepal")
-            self.select_dropdown("package_id", data["package_id"])
-
-            # Fill date fields
-            start_date_elem = self.driver.find_element(By.NAME, "start_date")
-            self.driver.execute_script(f"arguments[0].value = '{data['start_date']}'", start_date_elem)
-
-            end_date_elem = self.driver.find_element(By.NAME, "end_date")
-            self.driver.execute_script(f"arguments[0].value = '{data['end_date']}'", end_date_elem)
-
-            dob_elem = self.driver.find_element(By.NAME, "dob")
-            self.driver.execute_script(f"arguments[0].value = '{data['dob']}'", dob_elem)
-
-            # Fill text fields
-            self.driver.find_element(By.NAME, "surname").send_keys(data["surname"])
-            self.driver.find_element(By.NAME, "given_name").send_keys(data["given_name"])
-            self.driver.find_element(By.NAME, "phone_number").send_keys(data["phone_number"])
-            self.driver.find_element(By.NAME, "email").send_keys(data["email"])
-            self.driver.find_element(By.NAME, "address").send_keys(data["address"])
-            self.driver.find_element(By.NAME, "emergency_contact").send_keys(data["emergency_contact"])
-            self.driver.find_element(By.NAME, "passport_no").send_keys(data["passport_no"])
+            # Fill dropdown fields in one round-trip, falling back per field
+            dropdowns = {
+                "nationality": data["nationality"],
+                "travel_from": data["travel_from"],
+                "travel_to": "Nepal",
+                "package_id": data["package_id"],
+            }
+            unmatched = self.driver.execute_script(SELECT_OPTIONS_JS, dropdowns)
+            for name in unmatched:
+                self.select_dropdown(name, dropdowns[name])
+
+            # Fill date and text fields in one round-trip
+            fields = {
+                "start_date": data["start_date"],
+                "end_date": data["end_date"],
+                "dob": data["dob"],
+                "surname": data["surname"],
+                "given_name": data["given_name"],
+                "phone_number": data["phone_number"],
+                "email": data["email"],
+                "address": data["address"],
+                "emergency_contact": data["emergency_contact"],
+                "passport_no": data["passport_no"],
+            }
+            missing = self.driver.execute_script(FILL_FIELDS_JS, fields)
+            if missing:
+                logger.error(f"Form fields not found: {', '.join(missing)}")
+                return False
 
             # Upload files if provided
             if data.get("profile_image_path"):
@@ -166,45 +324,47 @@ class FormAutofiller:
             self.driver.execute_script("arguments[0].scrollIntoView(true);", dropdown)
             
             select2_container = self.driver.find_element(
-                By.XPATH, f"//select[@name='{name}']/following-sibling::span[contains(@class, 'select2-container')]"
+                By.CSS_SELECTOR, SELECT2_CONTAINER_CSS.format(name)
             )
             if select2_container:
                 select2_container.click()
             else:
                 dropdown.click()
             
-            time.sleep(1)
+            WebDriverWait(self.driver, 5).until(
+                EC.visibility_of_element_located(SELECT2_OPTION)
+            )
             
             option = self.driver.find_element(
-                By.XPATH, f"//li[contains(@class, 'select2-results__option') and text()='{value}']"
+                By.XPATH, SELECT2_OPTION_XPATH.format(xpath_literal(value))
             )
             option.click()
             return True
         except Exception as e:
             try:
                 logger.warning(f"Alternative selection failed, trying JavaScript approach: {e}")
-                script = f"""
-                var select = document.getElementsByName('{name}')[0];
-                for (var i = 0; i < select.options.length; i++) {{
-                    if (select.options[i].text === '{value}') {{
-                        select.selectedIndex = i;
-                        var event = new Event('change');
-                        select.dispatchEvent(event);
-                        break;
-                    }}
-                }}
-                """
-                self.driver.execute_script(script)
+                if self.driver.execute_script(SELECT_OPTIONS_JS, {name: value}):
+                    logger.error(f"Option {value} not found in dropdown {name}")
+                    return False
                 return True
             except Exception as e:
                 logger.error(f"Error selecting dropdown {name} with value {value}: {e}")
                 return False
 
+    def wait_until_submittable(self):
+        """Wait until no loading spinner is shown and return the clickable submit button."""
+        WebDriverWait(self.driver, 10).until(
+            EC.invisibility_of_element_located(LOADING_SPINNER)
+        )
+        return WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable(SUBMIT_BUTTON)
+        )
+
     def submit_form(self) -> bool:
         """Submit the form."""
         try:
             if SUBMIT:
-                submit_button = self.driver.find_element(By.XPATH, "//button[@type='submit']")
+                submit_button = self.wait_until_submittable()
                 submit_button.click()
             logger.info("Form submitted successfully")
             return True
@@ -212,17 +372,9 @@ class FormAutofiller:
             logger.error(f"Error submitting form: {e}")
             return False
 
-    def close(self):
-        """Close the browser."""
-        if self.driver:
-            self.driver.quit()
-            logger.info("Browser closed")
-
-    async def process_form(self, form_data: FormData) -> bool:
-        """Process the entire form filling workflow."""
+    def process_form(self, form_data: FormData) -> bool:
+        """Process the entire form filling workflow on the injected driver (blocking)."""
         try:
-            self._setup_driver()
-            
             if not self.login():
                 return False
                 
@@ -232,8 +384,6 @@ class FormAutofiller:
             if not self.fill_form(form_data.dict()):
                 return False
                 
-            time.sleep(2)  # Wait before submission
-            
             if not self.submit_form():
                 return False
                 
@@ -242,5 +392,3 @@ class FormAutofiller:
         except Exception as e:
             logger.error(f"Error processing form: {e}")
             return False
-        finally:
-            self.close()
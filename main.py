@@ -1,17 +1,24 @@
 import os
+import time
+import asyncio
 import httpx
-import shutil
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+import aiofiles
 import uvicorn
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
 from pathlib import Path
 from uuid import uuid4
 from fastapi import FastAPI, BackgroundTasks, HTTPException, File, UploadFile
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.formparsers import MultiPartParser
 # Import your custom modules
 from models import FormData, TaskStatus# Assuming this contains FormData, TaskStatus models
-from autofiller import FormAutofiller, logger
+from task_store import create_task_store
+from autofiller import FormAutofiller, create_driver, reset_driver, resolve_driver_path, logger
 from utils import process_passport_mrz
 
 # Configure logging
@@ -24,42 +31,182 @@ app = FastAPI(
     description="Combined service for form processing and file uploads"
 )
 
-# Global variables to track tasks
-task_storage: Dict[str, TaskStatus] = {}
+# Task storage: Redis when REDIS_URL is set (required for multiple workers), else in memory
+REDIS_URL = os.getenv("REDIS_URL")
+MAX_TASKS = int(os.getenv("MAX_TASKS", 1000))
+TASK_TTL = int(os.getenv("TASK_TTL", 3600))
+task_store = create_task_store(REDIS_URL, max_tasks=MAX_TASKS, ttl=TASK_TTL)
+
+# Uvicorn worker processes; tasks are only shared between workers through Redis
+WORKERS = int(os.getenv("WORKERS", 1)) if REDIS_URL else 1
 
 # Form processing configuration
 FORM_URL = os.getenv("FORM_URL", "https://adventurescare.com/agent/orders-management")
 LOGIN_URL = os.getenv("LOGIN_URL", "https://adventurescare.com/agent/login")
 
+# Browser pool configuration: every uvicorn worker starts its own pool,
+# so the host runs WORKERS * DRIVER_POOL_SIZE headless Chromes in total
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", 2))
+DRIVER_CREATE_ATTEMPTS = 3
+driver_pool: Optional[asyncio.Queue] = None
+driver_path: Optional[str] = None
+
+# Selenium calls block, so each checked-out driver runs on its own worker thread
+FORM_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=DRIVER_POOL_SIZE)
+
 # File upload configuration
 BASE_DIR = Path("static")
 PHOTO_DIR = BASE_DIR / "photos"
 PASSPORT_DIR = BASE_DIR / "passports"
 PDF_DIR = BASE_DIR / "pdfs"
 
+# Stream uploads to disk in 1 MiB chunks and keep small uploads in memory
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 8 * 1024 * 1024))
+MAX_PDF_SIZE = int(os.getenv("MAX_PDF_SIZE", 0))  # 0 leaves PDF uploads uncapped
+ALLOWED_IMAGE_EXTS = frozenset({"png", "jpg", "jpeg", "gif", "bmp"})
+MultiPartParser.spool_max_size = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE", 4 * 1024 * 1024))
+
 # Create directories
 for directory in [PHOTO_DIR, PASSPORT_DIR, PDF_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
+# Files per upload directory, seeded at startup and bumped on every saved upload;
+# only accurate with a single worker, otherwise /health scans the directories instead
+UPLOAD_DIRS = {"photos": PHOTO_DIR, "passports": PASSPORT_DIR, "pdfs": PDF_DIR}
+UPLOAD_COUNTS = {name: 0 for name in UPLOAD_DIRS}
+
 # Mount static folders
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+# === BROWSER POOL ===
+
+@app.on_event("startup")
+async def start_driver_pool():
+    """Resolve chromedriver once and pre-warm the pool of Chrome instances."""
+    global driver_pool, driver_path
+    loop = asyncio.get_running_loop()
+
+    # Browser failures must not stop the service: uploads and /health need no browser,
+    # and empty (None) slots are recreated on checkout
+    try:
+        driver_path = await loop.run_in_executor(FORM_EXECUTOR, resolve_driver_path)
+    except Exception as e:
+        logger.error(f"Failed to resolve chromedriver, falling back to Selenium Manager: {e}")
+    drivers = await asyncio.gather(
+        *(loop.run_in_executor(FORM_EXECUTOR, create_pooled_driver) for _ in range(DRIVER_POOL_SIZE)),
+        return_exceptions=True
+    )
+
+    driver_pool = asyncio.Queue(maxsize=DRIVER_POOL_SIZE)
+    started = 0
+    for driver in drivers:
+        if isinstance(driver, BaseException):
+            logger.error(f"Failed to start pooled driver, slot will be retried on checkout: {driver}")
+            driver = None
+        else:
+            started += 1
+        driver_pool.put_nowait(driver)
+    logger.info(f"Driver pool started with {started}/{DRIVER_POOL_SIZE} browser(s)")
+
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    """Quit every pooled Chrome instance."""
+    while driver_pool is not None and not driver_pool.empty():
+        driver = driver_pool.get_nowait()
+        if driver is None:
+            continue
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit pooled driver: {e}")
+    FORM_EXECUTOR.shutdown(wait=False)
+    logger.info("Driver pool stopped")
+
+
+def create_pooled_driver():
+    """Create a driver for the pool, retrying transient Chrome startup failures (blocking)."""
+    for attempt in range(1, DRIVER_CREATE_ATTEMPTS + 1):
+        try:
+            return create_driver(driver_path)
+        except Exception as e:
+            logger.warning(f"Failed to start pooled driver (attempt {attempt}/{DRIVER_CREATE_ATTEMPTS}): {e}")
+            if attempt == DRIVER_CREATE_ATTEMPTS:
+                raise
+            time.sleep(attempt)
+
+
+def recycle_driver(driver):
+    """Reset a driver for reuse, or return None for a dead browser so its slot is recreated on checkout (blocking)."""
+    try:
+        reset_driver(driver)
+        return driver
+    except Exception as e:
+        logger.warning(f"Pooled driver is unusable, recreating it on next checkout: {e}")
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        return None
+
+
+async def checkout_driver():
+    """Take a driver from the pool, lazily recreating a dead slot; the slot is kept if that fails."""
+    driver = await driver_pool.get()
+    if driver is None:
+        try:
+            driver = await asyncio.get_running_loop().run_in_executor(FORM_EXECUTOR, create_pooled_driver)
+        except Exception:
+            driver_pool.put_nowait(None)
+            raise
+    return driver
+
+
 # === FORM PROCESSING ENDPOINTS ===
 
+@app.on_event("startup")
+async def start_http_client():
+    """Create the shared keep-alive client used for callback requests."""
+    app.state.http = httpx.AsyncClient(
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        http2=True
+    )
+
+
+@app.on_event("shutdown")
+async def stop_http_client():
+    """Close the shared callback client and its pooled connections."""
+    await app.state.http.aclose()
+
+
+@app.on_event("shutdown")
+async def close_task_store():
+    """Release the task storage connection."""
+    await task_store.close()
+
+
+async def update_task(task_id: str, **fields):
+    """Apply field updates to a stored task, ignoring tasks deleted in the meantime."""
+    task = await task_store.get(task_id)
+    if task is None:
+        return
+    await task_store.save(task.model_copy(update=fields))
+
+
 async def call_callback_api(callback_url: str, task_id: str, success: bool):
     """Call the callback API to update the processed status."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                callback_url,
-                json={
-                    "is_active": True,
-                },
-                timeout=30.0
-            )
-            response.raise_for_status()
-            logger.info(f"Callback API called successfully for task {task_id}")
+        response = await app.state.http.patch(
+            callback_url,
+            json={
+                "is_active": True,
+            }
+        )
+        response.raise_for_status()
+        logger.info(f"Callback API called successfully for task {task_id}")
     except Exception as e:
         logger.error(f"Failed to call callback API for task {task_id}: {e}")
 
@@ -70,22 +217,25 @@ async def process_form_task(form_data: FormData):
     
     try:
         # Update task status to processing
-        task_storage[task_id].status = "processing"
-        task_storage[task_id].message = "Processing form submission..."
+        await update_task(task_id, status="processing", message="Processing form submission...")
         
-        # Initialize autofiller and process form
-        autofiller = FormAutofiller(form_url=FORM_URL, login_url=LOGIN_URL)
-        success = await autofiller.process_form(form_data)
+        # Check out a pooled driver and process form off the event loop
+        loop = asyncio.get_running_loop()
+        driver = await checkout_driver()
+        try:
+            autofiller = FormAutofiller(driver, form_url=FORM_URL, login_url=LOGIN_URL)
+            success = await loop.run_in_executor(FORM_EXECUTOR, autofiller.process_form, form_data)
+        finally:
+            driver = await loop.run_in_executor(FORM_EXECUTOR, recycle_driver, driver)
+            driver_pool.put_nowait(driver)
         
         # Update task status
         if success:
-            task_storage[task_id].status = "completed"
-            task_storage[task_id].message = "Form processed successfully"
+            await update_task(task_id, status="completed", message="Form processed successfully",
+                              completed_at=datetime.now())
         else:
-            task_storage[task_id].status = "failed"
-            task_storage[task_id].message = "Form processing failed"
-            
-        task_storage[task_id].completed_at = datetime.now()
+            await update_task(task_id, status="failed", message="Form processing failed",
+                              completed_at=datetime.now())
         
         # Call callback API if provided
         if form_data.callback_api_url:
@@ -93,9 +243,8 @@ async def process_form_task(form_data: FormData):
             
     except Exception as e:
         logger.error(f"Task {task_id} failed: {e}")
-        task_storage[task_id].status = "failed"
-        task_storage[task_id].message = f"Task failed: {str(e)}"
-        task_storage[task_id].completed_at = datetime.now()
+        await update_task(task_id, status="failed", message=f"Task failed: {str(e)}",
+                          completed_at=datetime.now())
         
         # Call callback API even on failure
         if form_data.callback_api_url:
@@ -111,17 +260,15 @@ async def submit_form(form_data: FormData, background_tasks: BackgroundTasks):
     """
     task_id = form_data.id
     
-    # Check if task already exists
-    if task_id in task_storage:
-        raise HTTPException(status_code=400, detail=f"Task with ID {task_id} already exists")
-    
-    # Create task status entry
-    task_storage[task_id] = TaskStatus(
+    # Create task status entry, rejecting IDs that already exist
+    created = await task_store.create(TaskStatus(
         task_id=task_id,
         status="queued",
         message="Task queued for processing",
         created_at=datetime.now()
-    )
+    ))
+    if not created:
+        raise HTTPException(status_code=400, detail=f"Task with ID {task_id} already exists")
     
     # Add background task
     background_tasks.add_task(process_form_task, form_data)
@@ -138,38 +285,115 @@ async def submit_form(form_data: FormData, background_tasks: BackgroundTasks):
 @app.get("/task-status/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """Get the status of a specific task."""
-    if task_id not in task_storage:
+    task = await task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
     
-    return task_storage[task_id]
+    return task
 
 
 @app.get("/tasks", response_model=Dict[str, TaskStatus])
 async def get_all_tasks():
     """Get the status of all tasks."""
-    return task_storage
+    return await task_store.all()
 
 
 @app.delete("/task/{task_id}")
 async def delete_task(task_id: str):
     """Delete a completed or failed task from storage."""
-    if task_id not in task_storage:
+    task = await task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
     
-    task = task_storage[task_id]
     if task.status == "processing":
         raise HTTPException(status_code=400, detail="Cannot delete a task that is currently processing")
     
-    del task_storage[task_id]
+    await task_store.delete(task_id)
     return {"message": f"Task {task_id} deleted successfully"}
 
 
 # === FILE UPLOAD ENDPOINTS ===
 
-def save_upload_file(file: UploadFile, save_path: Path):
-    """Helper function to save uploaded file."""
-    with save_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+# MRZ OCR is CPU-bound, so it runs in worker processes rather than on the event loop;
+# the cores are split between uvicorn workers, each of which owns a pool
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", max(1, (os.cpu_count() or 1) // WORKERS)))
+ocr_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+
+def get_ocr_pool(broken: Optional[concurrent.futures.ProcessPoolExecutor] = None):
+    """Return the OCR pool, replacing it if it is the broken pool a caller just hit."""
+    global ocr_pool
+    if ocr_pool is None or ocr_pool is broken:
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+        # forkserver avoids forking this process while executor threads are inside Selenium calls
+        ocr_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+    return ocr_pool
+
+
+@app.on_event("startup")
+async def start_ocr_pool():
+    """Start the process pool used for passport OCR."""
+    get_ocr_pool()
+
+
+async def run_ocr(image_path: str) -> dict:
+    """Run MRZ OCR in the pool, rebuilding it and retrying once if a worker process died."""
+    loop = asyncio.get_running_loop()
+    pool = get_ocr_pool()
+    try:
+        return await loop.run_in_executor(pool, process_passport_mrz, image_path)
+    except BrokenProcessPool as e:
+        logger.warning(f"OCR pool is broken, restarting it: {e}")
+        pool = get_ocr_pool(broken=pool)
+        return await loop.run_in_executor(pool, process_passport_mrz, image_path)
+
+
+@app.on_event("shutdown")
+async def stop_ocr_pool():
+    """Shut down the passport OCR process pool."""
+    if ocr_pool is not None:
+        ocr_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def count_files(directory: Path) -> int:
+    """Count directory entries with a single scandir pass."""
+    with os.scandir(directory) as entries:
+        return sum(1 for _ in entries)
+
+
+@app.on_event("startup")
+async def load_upload_counts():
+    """Seed the upload counters from what is already on disk."""
+    loop = asyncio.get_running_loop()
+    for name, directory in UPLOAD_DIRS.items():
+        UPLOAD_COUNTS[name] = await loop.run_in_executor(None, count_files, directory)
+
+
+def scan_upload_counts() -> Dict[str, int]:
+    """Count every upload directory on disk (blocking)."""
+    return {name: count_files(directory) for name, directory in UPLOAD_DIRS.items()}
+
+
+def get_upload_extension(file: UploadFile) -> str:
+    """Return the lowercased file extension without the leading dot."""
+    return Path(file.filename or "").suffix.lower()[1:]
+
+
+def check_upload_size(file: UploadFile, max_size: int):
+    """Reject uploads larger than max_size bytes; a max_size of 0 disables the check."""
+    if max_size and file.size and file.size > max_size:
+        raise HTTPException(status_code=413, detail=f"File {file.filename} exceeds {max_size} bytes")
+
+
+async def save_upload_file(file: UploadFile, save_path: Path):
+    """Helper function to stream an uploaded file to disk without blocking the event loop."""
+    async with aiofiles.open(save_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
 
 
 @app.post("/upload-images/")
@@ -178,16 +402,16 @@ async def upload_images(
     passport_image: UploadFile = File(...)
 ):
     """Upload profile and passport images, process passport MRZ data."""
-    allowed_image_exts = {"png", "jpg", "jpeg", "gif", "bmp"}
-    
-    # Validate file extensions
-    profile_ext = profile_image.filename.split(".")[-1].lower()
-    passport_ext = passport_image.filename.split(".")[-1].lower()
+    # Validate file extensions and sizes before touching disk
+    profile_ext = get_upload_extension(profile_image)
+    passport_ext = get_upload_extension(passport_image)
     
-    if profile_ext not in allowed_image_exts:
+    if profile_ext not in ALLOWED_IMAGE_EXTS:
         raise HTTPException(status_code=400, detail=f"Unsupported profile image type: .{profile_ext}")
-    if passport_ext not in allowed_image_exts:
+    if passport_ext not in ALLOWED_IMAGE_EXTS:
         raise HTTPException(status_code=400, detail=f"Unsupported passport image type: .{passport_ext}")
+    check_upload_size(profile_image, MAX_UPLOAD_SIZE)
+    check_upload_size(passport_image, MAX_UPLOAD_SIZE)
     
     # Generate unique names using uuid4
     profile_unique_name = f"profile_{uuid4().hex}.{profile_ext}"
@@ -195,12 +419,14 @@ async def upload_images(
     
     # Save profile image
     profile_path = PHOTO_DIR / profile_unique_name
-    save_upload_file(profile_image, profile_path)
+    await save_upload_file(profile_image, profile_path)
+    UPLOAD_COUNTS["photos"] += 1
     profile_url = f"/static/photos/{profile_unique_name}"
     
     # Save passport image
     passport_path = PASSPORT_DIR / passport_unique_name
-    save_upload_file(passport_image, passport_path)
+    await save_upload_file(passport_image, passport_path)
+    UPLOAD_COUNTS["passports"] += 1
     passport_url = f"/static/passports/{passport_unique_name}"
     
     # Verify passport file was saved
@@ -209,9 +435,12 @@ async def upload_images(
     
     # Process passport MRZ
     try:
-        mrz = process_passport_mrz(str(passport_path))
+        mrz = await run_ocr(str(passport_path))
         if "error" in mrz:
             raise HTTPException(status_code=400, detail=mrz["error"])
+    except BrokenProcessPool as e:
+        logger.error(f"OCR pool failed again after restart: {e}")
+        raise HTTPException(status_code=503, detail="Passport OCR is temporarily unavailable")
     except Exception as e:
         logger.error(f"Failed to process passport MRZ: {e}")
         raise HTTPException(status_code=500, detail="Failed to process passport MRZ data")
@@ -227,15 +456,17 @@ async def upload_images(
 @app.post("/upload-pdf/")
 async def upload_pdf(document: UploadFile = File(...)):
     """Upload PDF document."""
-    if not document.filename.lower().endswith(".pdf"):
+    if get_upload_extension(document) != "pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
+    check_upload_size(document, MAX_PDF_SIZE)
     
     # Generate unique name using uuid4
     pdf_unique_name = f"document_{uuid4().hex}.pdf"
     pdf_path = PDF_DIR / pdf_unique_name
     
     # Save PDF file
-    save_upload_file(document, pdf_path)
+    await save_upload_file(document, pdf_path)
+    UPLOAD_COUNTS["pdfs"] += 1
     pdf_url = f"/static/pdfs/{pdf_unique_name}"
     
     return JSONResponse(content={
@@ -249,16 +480,16 @@ async def upload_pdf(document: UploadFile = File(...)):
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
+    # Other workers' uploads are invisible to this process's counters, so count the disk
+    if WORKERS > 1:
+        static_dirs = await asyncio.get_running_loop().run_in_executor(None, scan_upload_counts)
+    else:
+        static_dirs = dict(UPLOAD_COUNTS)
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "active_tasks": len([t for t in task_storage.values() if t.status == "processing"]),
-        "total_tasks": len(task_storage),
-        "static_dirs": {
-            "photos": len(list(PHOTO_DIR.glob("*"))),
-            "passports": len(list(PASSPORT_DIR.glob("*"))),
-            "pdfs": len(list(PDF_DIR.glob("*")))
-        }
+        **await task_store.stats(),
+        "static_dirs": static_dirs
     }
 
 
@@ -295,8 +526,8 @@ def main():
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", 8000))
     
-    logger.info(f"Starting combined FastAPI service on {HOST}:{PORT}")
-    uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
+    logger.info(f"Starting combined FastAPI service on {HOST}:{PORT} with {WORKERS} worker(s)")
+    uvicorn.run("main:app", host=HOST, port=PORT, reload=WORKERS == 1, workers=WORKERS)
 
 
 if __name__ == "__main__":
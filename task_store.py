@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import redis.asyncio as redis
+from models import TaskStatus
+
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class MemoryTaskStore:
+    """In-process task storage, only valid for a single uvicorn worker."""
+
+    def __init__(self, max_tasks: int = 1000):
+        self.max_tasks = max_tasks
+        self.tasks: "OrderedDict[str, TaskStatus]" = OrderedDict()
+
+    async def create(self, task: TaskStatus) -> bool:
+        """Store a new task, returning False if the ID is already taken."""
+        if task.task_id in self.tasks:
+            return False
+        self.tasks[task.task_id] = task
+        self._prune()
+        return True
+
+    async def get(self, task_id: str) -> Optional[TaskStatus]:
+        return self.tasks.get(task_id)
+
+    async def save(self, task: TaskStatus):
+        self.tasks[task.task_id] = task
+
+    async def delete(self, task_id: str):
+        self.tasks.pop(task_id, None)
+
+    async def all(self) -> Dict[str, TaskStatus]:
+        return dict(self.tasks)
+
+    async def stats(self) -> Dict[str, int]:
+        """Task counts for /health."""
+        active = sum(1 for task in self.tasks.values() if task.status == "processing")
+        return {"active_tasks": active, "total_tasks": len(self.tasks)}
+
+    async def close(self):
+        pass
+
+    def _prune(self):
+        """Evict the oldest finished tasks once storage grows past max_tasks."""
+        excess = len(self.tasks) - self.max_tasks
+        if excess <= 0:
+            return
+        finished = [task_id for task_id, task in self.tasks.items() if task.status in FINISHED_STATUSES]
+        for task_id in finished[:excess]:
+            del self.tasks[task_id]
+
+
+class RedisTaskStore:
+    """Redis-backed task storage shared by every uvicorn worker; entries expire after ttl seconds."""
+
+    # Sorted sets of task IDs scored by expiry time, so /health can count without scanning
+    INDEX_KEY = "tasks:index"
+    PROCESSING_KEY = "tasks:processing"
+
+    def __init__(self, url: str, ttl: int = 3600):
+        self.ttl = ttl
+        self.redis = redis.from_url(url)
+
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"task:{task_id}"
+
+    def _index(self, pipe, task: TaskStatus):
+        """Queue the index updates that mirror a task write and its TTL."""
+        expires_at = time.time() + self.ttl
+        pipe.zadd(self.INDEX_KEY, {task.task_id: expires_at})
+        if task.status == "processing":
+            pipe.zadd(self.PROCESSING_KEY, {task.task_id: expires_at})
+        else:
+            pipe.zrem(self.PROCESSING_KEY, task.task_id)
+
+    async def create(self, task: TaskStatus) -> bool:
+        """Store a new task, returning False if the ID is already taken."""
+        created = await self.redis.set(self._key(task.task_id), task.model_dump_json(), ex=self.ttl, nx=True)
+        if created:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                self._index(pipe, task)
+                await pipe.execute()
+        return bool(created)
+
+    async def get(self, task_id: str) -> Optional[TaskStatus]:
+        raw = await self.redis.get(self._key(task_id))
+        return TaskStatus.model_validate_json(raw) if raw else None
+
+    async def save(self, task: TaskStatus):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(task.task_id), task.model_dump_json(), ex=self.ttl)
+            self._index(pipe, task)
+            await pipe.execute()
+
+    async def delete(self, task_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(task_id))
+            pipe.zrem(self.INDEX_KEY, task_id)
+            pipe.zrem(self.PROCESSING_KEY, task_id)
+            await pipe.execute()
+
+    async def all(self) -> Dict[str, TaskStatus]:
+        keys = [key async for key in self.redis.scan_iter(match=self._key("*"))]
+        if not keys:
+            return {}
+        tasks = (TaskStatus.model_validate_json(raw) for raw in await self.redis.mget(keys) if raw)
+        return {task.task_id: task for task in tasks}
+
+    async def stats(self) -> Dict[str, int]:
+        """Task counts for /health, dropping index entries whose task keys have expired."""
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self.INDEX_KEY, "-inf", now)
+            pipe.zremrangebyscore(self.PROCESSING_KEY, "-inf", now)
+            pipe.zcard(self.PROCESSING_KEY)
+            pipe.zcard(self.INDEX_KEY)
+            *_, active, total = await pipe.execute()
+        return {"active_tasks": active, "total_tasks": total}
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_task_store(redis_url: Optional[str], max_tasks: int, ttl: int):
+    """Use Redis when configured so tasks are visible to every worker, else keep them in memory."""
+    if redis_url:
+        return RedisTaskStore(redis_url, ttl=ttl)
+    return MemoryTaskStore(max_tasks=max_tasks)
@@ -1,9 +1,84 @@
 
 from passporteye import read_mrz
 import pytesseract
-import json
-import re
+import os
+import orjson
+try:
+    # Linear-time DFA matching when the optional google-re2 bindings are installed
+    import re2 as re
+except ImportError:
+    import re
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import difflib
+from rapidfuzz import fuzz, process
+from pathlib import Path
+from types import MappingProxyType
+
+# Nationality codes are static, so parse the map once at import and expose it read-only
+with open(Path(__file__).with_name("nationality_map.json"), "rb") as f:
+    _NATIONALITY_MAP = MappingProxyType(orjson.loads(f.read()))
+_NATIONALITY_KEYS = tuple(_NATIONALITY_MAP.keys())
+
+
+def _index_nationality_keys():
+    """Bucket codes by length and by each single masked position (e.g. 'N?L')."""
+    by_len, by_mask = {}, {}
+    for key in _NATIONALITY_KEYS:
+        by_len.setdefault(len(key), []).append(key)
+        for i in range(len(key)):
+            by_mask.setdefault(key[:i] + "?" + key[i + 1:], []).append(key)
+    return (
+        {length: tuple(keys) for length, keys in by_len.items()},
+        {mask: tuple(keys) for mask, keys in by_mask.items()},
+    )
+
+
+_NAT_KEYS_BY_LEN, _NAT_KEYS_BY_MASK = _index_nationality_keys()
+
+_NON_ALNUM_CODE_RE = re.compile(r'[^A-Za-z0-9]')
+
+
+def _normalize_code(code):
+    """Uppercase a nationality code and drop fillers, spaces and punctuation."""
+    return _NON_ALNUM_CODE_RE.sub('', code).upper()
+
+
+# Normalized-form lookup so OCR noise like 'npl<' or 'N PL' resolves without fuzzy matching
+_NATIONALITY_BY_NORM = MappingProxyType({
+    _normalize_code(key): name for key, name in _NATIONALITY_MAP.items()
+})
+
+# OCR corrections for the digit part of a passport number, as a byte LUT
+_PASSPORT_TABLE = bytes.maketrans(b'OQDILZSBG', b'000112586')
+# Every byte that is not A-Z or 0-9, deleted in the same translate pass
+_NON_ALNUM_BYTES = bytes(c for c in range(256) if not (0x30 <= c <= 0x39 or 0x41 <= c <= 0x5A))
+# MRZ filler plus the whitespace str.strip() removes from ASCII text
+_MRZ_PADDING = b'< \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+_TRAILING_K_RE = re.compile(r'\s*K+$')
+_LT_TO_SPACE = str.maketrans('<', ' ')
+
+def _format_mrz_date(date_str, is_dob):
+    """Convert an MRZ YYMMDD date to YYYY-MM-DD; anything but six ASCII digits is returned untouched."""
+    if not date_str or len(date_str) != 6:
+        return None
+    if not (date_str.isascii() and date_str.isdigit()):
+        return date_str
+
+    # Validated ASCII digits, so parse each pair directly from code points
+    year = (ord(date_str[0]) - 48) * 10 + ord(date_str[1]) - 48
+    month = (ord(date_str[2]) - 48) * 10 + ord(date_str[3]) - 48
+    day = (ord(date_str[4]) - 48) * 10 + ord(date_str[5]) - 48
+
+    # Birth dates from 30 onwards fall in the previous century, expiry dates never do
+    year += 2000 - 100 * (is_dob and year >= 30)
+
+    if month < 1 or month > 12 or day < 1 or day > 31:
+        return date_str  # Invalid date parts
+
+    # Month and day are already zero-padded in the source string
+    return f"{year}-{date_str[2:4]}-{date_str[4:6]}"
+
 
 def process_passport_mrz(image_path):
     """
@@ -25,69 +100,88 @@ def process_passport_mrz(image_path):
     # Extract MRZ data
     mrz_data = mrz.to_dict()
 
-    # Format dates (convert from YYMMDD to YYYY-MM-DD format)
-    def format_date(date_str):
-        if not date_str or len(date_str) != 6:
-            return None
-        try:
-            year = int(date_str[:2])
-            month = int(date_str[2:4])
-            day = int(date_str[4:6])
-
-            # Determine century
-            if date_str == mrz_data.get('date_of_birth', ''):
-                year = 2000 + year if year < 30 else 1900 + year
-            else:
-                year = 2000 + year
-
-            if month < 1 or month > 12 or day < 1 or day > 31:
-                return date_str  # Invalid date parts
-
-            return f"{year}-{month:02d}-{day:02d}"
-        except ValueError:
-            return date_str
-
     # Determine name fields with fallback logic
     raw_names = mrz_data.get('names', '')
     raw_surname = mrz_data.get('surname', '')
 
     if raw_names and len(raw_names.split(" ")[0]) > 1:
-        given_name = re.sub(r'\s*K+$', '', raw_names.replace('<', ' ').strip())
-        surname = raw_surname.replace('<', ' ').strip()
+        given_name = _TRAILING_K_RE.sub('', raw_names.translate(_LT_TO_SPACE).strip())
+        surname = raw_surname.translate(_LT_TO_SPACE).strip()
     else:
         # Fallback if 'names' is missing or blank
-        given_name = raw_surname.replace('<', ' ').strip()
+        given_name = raw_surname.translate(_LT_TO_SPACE).strip()
         surname = ""  # Same as name field
 
-    formatted_data = {
-        "nationality": get_nationality(mrz_data.get('nationality', '')),
-        "surname": surname,
-        "given_name": given_name,
-        "sex": mrz_data.get('sex', ''),
-        "dob": format_date(mrz_data.get('date_of_birth', '')),
-        "passport_no": clean_passport_number(mrz_data.get('number', ''))
-    }
+    formatted_fields = (
+        ("nationality", get_nationality(mrz_data.get('nationality', ''))),
+        ("surname", surname),
+        ("given_name", given_name),
+        ("sex", mrz_data.get('sex', '')),
+        ("dob", _format_mrz_date(mrz_data.get('date_of_birth', ''), is_dob=True)),
+        ("passport_no", clean_passport_number(mrz_data.get('number', '')))
+    )
 
-    # Clean empty fields
-    def clean_dict(d):
-        return {k: v for k, v in d.items() if v not in (None, '', {}, [])}
+    # Build the result in one pass, skipping empty fields (all values are str or None)
+    return {key: value for key, value in formatted_fields if value}
 
-    return clean_dict(formatted_data)
 
+def process_passports(image_paths, workers=None):
+    """
+    Process a batch of passport images concurrently.
 
-def get_nationality(code):
-    """Convert nationality code to full name with fuzzy fallback."""
-    with open("nationality_map.json", "r") as f:
-        nationality_map = json.load(f)
+    Tesseract runs as a subprocess and image decoding happens in C, so the
+    GIL is released for most of each call and threads overlap well. All
+    lookup tables and regexes are module-level, so no per-image setup is repeated.
 
-    # If exact match, return it
-    if code in nationality_map:
-        return nationality_map[code]
+    Args:
+        image_paths (list): Paths to the scanned passport images
+        workers (int): Number of worker threads, defaults to the CPU count
+
+    Returns:
+        list: Formatted passport data for each image, in input order
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(process_passport_mrz, image_paths))
 
-    # Fuzzy match: find closest code
-    close_matches = difflib.get_close_matches(code, nationality_map.keys(), n=1, cutoff=0.6)
-    if close_matches:
-        return nationality_map[close_matches[0]]
+
+def _closest_code(code, candidates):
+    """
+    Return the best candidate under difflib's original acceptance rule (ratio >= 0.6).
+
+    rapidfuzz's Indel ratio is never below difflib's Ratcliff-Obershelp ratio, so
+    screening with it first cannot drop a match difflib would accept; difflib then
+    only scores the few survivors.
+    """
+    # Cutoff just under 60 leaves slack for float rounding at the boundary
+    screened = [hit for hit, _, _ in process.extract(code, candidates, scorer=fuzz.ratio, score_cutoff=59, limit=None)]
+    matches = difflib.get_close_matches(code, screened, n=1, cutoff=0.6)
+    return matches[0] if matches else None
+
+
+@lru_cache(maxsize=1024)
+def get_nationality(code):
+    """Convert nationality code to full name with fuzzy fallback; results are memoized."""
+    # If exact match, return it before any fuzzy scoring
+    if code in _NATIONALITY_MAP:
+        return _NATIONALITY_MAP[code]
+
+    # Normalized form is still a single dict probe
+    normalized = _normalize_code(code)
+    if normalized in _NATIONALITY_BY_NORM:
+        return _NATIONALITY_BY_NORM[normalized]
+
+    # OCR misreads are usually a single substituted character, so try codes
+    # differing in one position first and only then widen to same-length codes
+    shortlist = [
+        key
+        for i in range(len(normalized))
+        for key in _NAT_KEYS_BY_MASK.get(normalized[:i] + "?" + normalized[i + 1:], ())
+    ]
+    close_match = _closest_code(normalized, shortlist) if shortlist else None
+    if close_match is None:
+        close_match = _closest_code(normalized, _NAT_KEYS_BY_LEN.get(len(normalized), _NATIONALITY_KEYS))
+    if close_match:
+        return _NATIONALITY_MAP[close_match]
 
     # No match found, return the input code as-is
     return code
@@ -101,11 +195,14 @@ def clean_passport_number(raw_number: str) -> str:
     if not raw_number:
         return ""
 
-    # Replace MRZ filler character with space, then strip
-    number = raw_number.replace('<', ' ').strip().upper()
+    # MRZ data is ASCII: encode once and strip filler/whitespace from both ends;
+    # interior fillers are dropped by the translate delete set below
+    number = raw_number.encode('ascii', 'ignore').strip(_MRZ_PADDING)
+    if not number.isupper():
+        number = number.upper()
 
     # Take first two characters as letters, correct only if obviously misread
-    corrected_prefix = number[:2]
+    corrected_prefix = number[:2].translate(None, _NON_ALNUM_BYTES)
     # prefix_corrections = {
     #     '0': 'O',
     #     '1': 'I',
@@ -115,22 +212,10 @@ def clean_passport_number(raw_number: str) -> str:
     # }
     # corrected_prefix = ''.join(prefix_corrections.get(c, c) for c in prefix)
 
-    # Apply stricter correction to remaining characters, assumed to be digits
-    suffix = number[2:]
-    digit_corrections = {
-        'O': '0',
-        'Q': '0',
-        'D': '0',
-        'I': '1',
-        'L': '1',
-        'Z': '2',
-        'S': '5',
-        'B': '8',
-        'G': '6'
-    }
-    corrected_suffix = ''.join(digit_corrections.get(c, c) for c in suffix)
-
-    # Combine and remove any non-alphanumeric characters (if needed)
-    cleaned = ''.join(filter(str.isalnum, corrected_prefix + corrected_suffix))
+    # Apply stricter correction to remaining characters, assumed to be digits,
+    # dropping non-alphanumerics in the same pass
+    corrected_suffix = number[2:].translate(_PASSPORT_TABLE, _NON_ALNUM_BYTES)
+
+    cleaned = (corrected_prefix + corrected_suffix).decode('ascii')
 
     return cleaned